@@ -1,12 +1,101 @@
 import os
+import re
 import json
 import time
 import random
-import logging
 import hashlib
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from datetime import datetime, timezone
 from typing import Dict, Any, List, Optional
+from urllib.parse import urlencode
 import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import orjson  # optional: much faster parse/serialize on the hot paths
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa            # optional: columnar Parquet output
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:
+    from pybloom_live import ScalableBloomFilter  # optional: bounded-memory dedupe
+except ImportError:
+    ScalableBloomFilter = None
+
+
+# Allowed ticker characters (ASCII letters/digits plus . and -), matched in C
+_TICKER_RE = re.compile(r"[A-Za-z0-9.\-]+")
+
+
+def _dumps(obj: Any) -> bytes:
+    """Compact JSON bytes for one object (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def _loads(raw: bytes) -> Any:
+    """Parse a JSON response body (orjson when available)."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _write_json(path: str, obj: Any):
+    """Write obj as 2-space indented JSON (orjson when available)."""
+    if orjson is not None:
+        with open(path, "wb") as f:
+            # NON_STR_KEYS: distribution counts can be keyed by None, which json writes as "null"
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(path, "w") as f:
+            json.dump(obj, f, indent=2)
+
+
+def _write_records(path: str, records: List[Dict[str, Any]], fmt: str = "json"):
+    """
+    Write records as a JSON array or NDJSON (streamed one record at a time),
+    or as zstd-compressed Parquet (dictionary-encodes repeated market/exchange values).
+    """
+    if fmt == "parquet":
+        pq.write_table(pa.Table.from_pylist(records), path, compression="zstd")
+        return
+    with open(path, "wb") as f:
+        if fmt == "ndjson":
+            for rec in records:
+                f.write(_dumps(rec))
+                f.write(b"\n")
+            return
+        f.write(b"[")
+        for i, rec in enumerate(records):
+            f.write(b",\n  " if i else b"\n  ")
+            f.write(_dumps(rec))
+        f.write(b"\n]\n" if records else b"]\n")
+
+
+def _make_projector(fields):
+    """
+    Compile a function that trims a record to `fields` with one straight-line dict
+    display ({'ticker': get('ticker'), ...}); missing fields become None.
+    Generated once per run, the same way dataclasses builds its __init__.
+    """
+    body = ", ".join(f"{k!r}: get({k!r})" for k in fields)
+    namespace: Dict[str, Any] = {}
+    exec(f"def project(rec):\n    get = rec.get\n    return {{{body}}}\n", namespace)
+    return namespace["project"]
 
 
 class DataCollectionAgent:
@@ -21,9 +110,17 @@ class DataCollectionAgent:
       5) Respectful Collection (respectful_delay + check_rate_limits)
     """
 
+    # Cubic-style rate controller constants (as in TCP Cubic / AWS adaptive retry)
+    CUBIC_C = 0.4       # growth scaling
+    CUBIC_BETA = 0.7    # multiplicative decrease on throttling
+
     def __init__(self, config_file: str):
         """Initialize agent with configuration from your DMP"""
         self.config = self.load_config(config_file)
+        # Field lists are fixed for the run; hoist them out of the per-record loops
+        self._required_fields = tuple(self.config["required_fields"])
+        self._keep_fields = tuple(self.config["fields_to_keep"])
+        self._dedupe_fields = tuple(self.config["dedupe_key_fields"])
         self.setup_logging()
         self.logger.info("Initializing DataCollectionAgent")
 
@@ -36,19 +133,61 @@ class DataCollectionAgent:
         self.data_store: List[Dict[str, Any]] = []
         self.collection_stats = {
             'start_time': datetime.now(timezone.utc).isoformat(),
-            'total_requests': 0,
-            'successful_requests': 0,
-            'failed_requests': 0,
             'data_quality_score': 0.0,
             'last_quality_score': 0.0,
-            'pages_fetched': 0,
             'apis_used': ["polygon"]
         }
-        self.delay_multiplier = 1.0
-        self._seen_hashes = set()
+        # Request counters bumped on every attempt live as plain ints;
+        # summary() folds them back into the collection_stats shape.
+        self._total_requests = 0
+        self._successful = 0
+        self._failed = 0
+        self._pages = 0
+        # Adaptive request rate (requests/sec): starts at the configured budget,
+        # is cut on throttling and regrows along a cubic curve (adjust_strategy).
+        self.max_rate = 1.0 / self.min_request_interval()
+        self.min_rate = self.max_rate / 8.0
+        self.rate = self.max_rate
+        self.rate_max = self.rate           # rate at which throttling last began
+        self.last_decrease_t: Optional[float] = None
+        self._prev_sleep = self.min_request_interval()   # for decorrelated jitter
+        # Token bucket refilled at self.rate; burst_capacity > 1 lets idle time be spent as a burst
+        self.burst_capacity = max(1.0, float(self.config["burst_capacity"]))
+        self._tokens = self.burst_capacity
+        self._last_refill = time.monotonic()
+        self._seen_keys = self.make_seen_keys()
+        # Running quality counters, updated once per stored record (see store_data)
+        self._ok_complete = 0
+        self._ok_accuracy = 0
+        self._ok_consistency = 0
+        self._qa_assessed_len = 0     # data_store size at the last assess_data_quality
+        # Running report counters (see store_data), so the QA report never rescans data_store
+        self._fields_seen: set = set()
+        self._field_present: Counter = Counter()
+        self._ticker_counts: Counter = Counter()
+        self._invalid_tickers: List[str] = []
         self._last_status_code = None
-        self._last_headers: Dict[str, str] = {}
+        self._last_headers: CaseInsensitiveDict = CaseInsensitiveDict()
         self._cursor_next_url: Optional[str] = None  # pagination via next_url if present
+        self._next_allowed_t: Optional[float] = None  # monotonic time the server window reopens
+        self._next_request_t = 0.0  # monotonic deadline for the next request (respectful delay)
+        # Independent partitions (e.g. ticker ranges) each follow their own next_url chain
+        self._partition_cursors: List[Optional[str]] = [None] * len(self.config["partitions"])
+        self._partition_done: List[bool] = [False] * len(self.config["partitions"])
+        self._lock = threading.Lock()  # guards stats/rate updates from worker threads
+        self._etag_store: Dict[str, Dict[str, str]] = self.load_http_cache()
+        # fields_to_keep is fixed for the run, so its projection is compiled once
+        self._project = _make_projector(self._keep_fields) if self._keep_fields else None
+
+        # One pooled session for the whole run: keep-alive reuses the TCP+TLS
+        # connection across pages instead of handshaking on every request.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Polygon accepts the key as a bearer token, so it travels in a header
+        # set once rather than being re-encoded into every query string.
+        self.session.headers.update({"Authorization": f"Bearer {self.api_key}"})
 
     # -------------------------
     # (1) CONFIG MANAGEMENT
@@ -64,152 +203,397 @@ class DataCollectionAgent:
         cfg.setdefault("params", {"active": "true", "limit": 100})
         cfg.setdefault("max_pages", 3)                 # how many pages (batches) to fetch
         cfg.setdefault("target_records", 250)          # stop once we have roughly this many
-        cfg.setdefault("base_delay", 1.0)              # seconds, will be scaled by delay_multiplier
+        cfg.setdefault("base_delay", 1.0)              # seconds, floor on the gap between requests
         cfg.setdefault("retry", {"tries": 3, "backoff_seconds": 1.5})
+        cfg["retry"].setdefault("max_retry_after_seconds", 60)  # cap on a server-requested Retry-After wait
         cfg.setdefault("required_fields", ["ticker", "name"])
         cfg.setdefault("fields_to_keep", ["ticker", "name", "market", "locale", "primary_exchange"])
         cfg.setdefault("dedupe_key_fields", ["ticker"])
+        cfg.setdefault("dedupe_mode", "exact")         # "exact" (set) or "bloom" (probabilistic, bounded memory)
+        if cfg["dedupe_mode"] not in ("exact", "bloom"):
+            raise ValueError(f"Unsupported dedupe_mode: {cfg['dedupe_mode']!r} (use 'exact' or 'bloom').")
         cfg.setdefault("respect_rpm", 4)               # desired requests per minute budget (soft)
+        cfg.setdefault("burst_capacity", 1)            # max back-to-back requests the token bucket allows
+        cfg.setdefault("partitions", [])               # optional param overrides fetched concurrently,
+                                                       # e.g. [{"ticker.lt": "M"}, {"ticker.gte": "M"}]
         cfg.setdefault("output", {
             "json_path": "agent_output.json",
             "log_path": "data_collection.log"
         })
+        cfg.setdefault("cache_dir", ".http_cache")     # ETag/Last-Modified cache between runs ("" disables)
+        cfg.setdefault("output_format", "json")        # "json" (array), "ndjson" (one record per line) or "parquet"
+        if cfg["output_format"] not in ("json", "ndjson", "parquet"):
+            raise ValueError(
+                f"Unsupported output_format: {cfg['output_format']!r} (use 'json', 'ndjson' or 'parquet').")
+        if cfg["output_format"] == "parquet" and pq is None:
+            raise ImportError("output_format 'parquet' requires pyarrow (pip install pyarrow).")
+        # One records path per format, so e.g. Parquet never lands in a .json file;
+        # unset ones reuse json_path's name with the format's extension.
+        out = cfg["output"]
+        out.setdefault("json_path", "agent_output.json")
+        stem = os.path.splitext(out["json_path"])[0]
+        out.setdefault("ndjson_path", stem + ".ndjson")
+        out.setdefault("parquet_path", stem + ".parquet")
         return cfg
 
+    def make_seen_keys(self):
+        """
+        Membership structure for store_data's dedupe keys.
+          - "exact": a set of key tuples (no false positives, grows with the run).
+          - "bloom": a ScalableBloomFilter (~1e-4 false-positive rate, a few bits per key),
+            for multi-million-record runs where a set would dominate memory.
+        """
+        if self.config["dedupe_mode"] != "bloom":
+            return set()
+        if ScalableBloomFilter is None:
+            raise ImportError("dedupe_mode 'bloom' requires pybloom_live (pip install pybloom-live).")
+        return ScalableBloomFilter(initial_capacity=max(1000, int(self.config["target_records"])),
+                                   error_rate=1e-4)
+
     def setup_logging(self):
-        """Setup logging for the agent"""
+        """
+        Setup logging for the agent.
+          - The collection loop only enqueues records (QueueHandler); a background
+            QueueListener owns the file/stream handlers and does the actual I/O.
+          - Idempotent: a second call on a running agent keeps the existing pipeline.
+        """
+        if getattr(self, "_log_listener", None) is not None:
+            return
         log_path = self.config.get("output", {}).get("log_path", "data_collection.log")
-        logging.basicConfig(
-            level=logging.INFO,
-            format="%(asctime)s - %(levelname)s - %(message)s",
-            handlers=[
-                logging.FileHandler(log_path),
-                logging.StreamHandler()
-            ]
-        )
+        self._log_listener = None
+        self._queue_handler = None
+        if not logging.getLogger().handlers:
+            formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+            handlers = [logging.FileHandler(log_path), logging.StreamHandler()]
+            for h in handlers:
+                h.setFormatter(formatter)
+            log_queue = queue.SimpleQueue()
+            self._queue_handler = logging.handlers.QueueHandler(log_queue)
+            # QueueHandler pre-formats the message only; the listener's handlers add timestamp/level
+            logging.basicConfig(level=logging.INFO, format="%(message)s",
+                                handlers=[self._queue_handler])
+            self._log_listener = logging.handlers.QueueListener(log_queue, *handlers)
+            self._log_listener.start()
+            atexit.register(self.close)
         self.logger = logging.getLogger(__name__)
 
+    def flush_logs(self):
+        """Write out any queued log records (e.g. before reading the log file back)."""
+        if self._log_listener is not None:
+            self._log_listener.stop()   # drains the queue and joins the thread
+            self._log_listener.start()
+
+    def close(self):
+        """
+        Release the HTTP session and stop background logging; safe to call more than once.
+          - The QueueHandler is detached from the root logger, so later log calls (or a
+            new agent's setup_logging) don't feed a queue that nothing drains.
+        """
+        session = getattr(self, "session", None)
+        if session is not None:
+            session.close()
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            for h in self._log_listener.handlers:
+                h.close()
+            self._log_listener = None
+        if self._queue_handler is not None:
+            logging.getLogger().removeHandler(self._queue_handler)
+            self._queue_handler = None
+            atexit.unregister(self.close)
+
     # -------------------------
     # (2) INTELLIGENT STRATEGY
     # -------------------------
     def collect_data(self):
-        """Main collection loop with adaptive strategy"""
+        """
+        Main collection loop with adaptive strategy.
+          - Pages of one query are fetched one after another on purpose: each page's
+            next_url cursor comes from the previous response, and the respect_rpm
+            budget (not round-trip time) bounds how fast pages can be requested.
+          - If config "partitions" are given, their chains are independent, so one
+            page per partition is fetched concurrently (see fetch_batch).
+        """
         self.logger.info("Starting data collection")
         while not self.collection_complete():
             # 1) Assess quality
             quality_score = self.assess_data_quality()
             self.collection_stats['last_quality_score'] = quality_score
 
-            # 2) Adapt if success rate is low/high
-            if self.get_success_rate() < 0.8:
-                self.adjust_strategy()
+            # 2) Adapt request rate (regrows after any throttling)
+            self.adjust_strategy()
+
+            # 3) Make request(s) (with rate limiting + retries)
+            if self.config["partitions"]:
+                pages, n_requests = self.fetch_batch()
             else:
-                # still allow mild positive feedback
-                if self.get_success_rate() > 0.9:
-                    self.delay_multiplier = max(0.5, self.delay_multiplier * 0.9)
+                pages, n_requests = [self.make_api_request()], 1
 
-            # 3) Make request (with rate limiting + retries)
-            data = self.make_api_request()
+            # Start the politeness clock now so the processing below overlaps the wait
+            self.schedule_next_request(n_requests)
 
             # 4) Process + validate + store
-            if data:
-                processed = self.process_data(data)
-                if self.validate_data(processed):
-                    self.store_data(processed)
+            for data in pages:
+                if data:
+                    processed = self.process_data(data)
+                    if self.validate_data(processed):
+                        self.store_data(processed)
 
-            # 5) Respectful delay
-            self.respectful_delay()
+            # 5) Respectful delay: sleep only what is left of the window
+            if not self.collection_complete():
+                self.wait_for_next_request()
 
         self.logger.info("Collection complete")
 
     def collection_complete(self) -> bool:
         """Stop when we hit target records OR max pages."""
         enough_records = len(self.data_store) >= int(self.config["target_records"])
-        too_many_pages = self.collection_stats["pages_fetched"] >= int(self.config["max_pages"])
-        return enough_records or too_many_pages
+        too_many_pages = self._pages >= int(self.config["max_pages"])
+        partitions_exhausted = bool(self._partition_done) and all(self._partition_done)
+        return enough_records or too_many_pages or partitions_exhausted
 
     def make_api_request(self) -> Optional[Dict[str, Any]]:
-        """Perform one API call to Polygon (supports next_url pagination if provided)."""
+        """
+        Perform one API call to Polygon (supports next_url pagination if provided).
+          - The cursor is cleared (None) once the final allowed page is fetched
+            (max_pages reached), so it never points at a page already consumed.
+        """
+        data = self.fetch_one(self._cursor_next_url)
+        if data is not None:
+            # capture next_url if present, unless this was the last page we may fetch
+            self._cursor_next_url = (data.get("next_url")
+                                     if self._pages < int(self.config["max_pages"]) else None)
+        return data
+
+    def fetch_batch(self):
+        """
+        Fetch the next page of every unfinished partition concurrently.
+          - Threads share the pooled Session; batch size is capped by the RPM budget
+            and by the pages still allowed under max_pages.
+          - Returns (pages, number_of_requests_made).
+        """
+        remaining_pages = int(self.config["max_pages"]) - self._pages
+        jobs = [i for i, done in enumerate(self._partition_done) if not done][:max(1, remaining_pages)]
+        workers = max(1, min(len(jobs), int(float(self.config["respect_rpm"])), 8))
+
+        def run(i: int) -> Optional[Dict[str, Any]]:
+            return self.fetch_one(self._partition_cursors[i], self.config["partitions"][i])
+
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            pages = list(ex.map(run, jobs))
+
+        for i, data in zip(jobs, pages):
+            if data is not None:
+                self._partition_cursors[i] = data.get("next_url")
+                self._partition_done[i] = not self._partition_cursors[i]
+        return pages, len(jobs)
+
+    def fetch_one(self, next_url: Optional[str] = None,
+                  extra_params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """One page with retries: next_url when continuing a chain, else the configured query."""
         tries = int(self.config["retry"]["tries"])
         backoff = float(self.config["retry"]["backoff_seconds"])
-        self.collection_stats["total_requests"] += 1
+        with self._lock:
+            self._total_requests += 1
 
         for attempt in range(1, tries + 1):
             try:
-                if self._cursor_next_url:
-                    # next_url already includes query; still attach apiKey
-                    url = self._cursor_next_url
-                    params = {"apiKey": self.api_key}
+                if next_url:
+                    # next_url already includes the query (auth is in the session header)
+                    url = next_url
+                    params = None
                 else:
                     url = self.config["base_url"] + self.config["endpoint"]
-                    params = dict(self.config["params"])
-                    params["apiKey"] = self.api_key
+                    params = self.config["params"]
+                    if extra_params:
+                        params = {**params, **extra_params}
 
-                resp = requests.get(url, params=params, timeout=10)
+                # Revalidate pages seen on a previous run; a 304 costs no body and reuses the cache
+                cache_key = url if not params else f"{url}?{urlencode(params)}"
+                headers = self.conditional_headers(cache_key)
+
+                resp = self.session.get(url, params=params, headers=headers, timeout=10)
                 self._last_status_code = resp.status_code
-                self._last_headers = dict(resp.headers)
+                self._last_headers = resp.headers  # already case-insensitive; no copy needed
+
+                if resp.status_code == 304:
+                    page = self.cached_page(cache_key)
+                    if page is not None:
+                        with self._lock:
+                            self._successful += 1
+                            self._pages += 1
+                        self.logger.info("304 Not Modified; reusing cached page")
+                        return page
+                    # validators without a usable cached body (missing or corrupt):
+                    # forget them and refetch in full, unconditionally
+                    with self._lock:
+                        self._etag_store.pop(cache_key, None)
+                    resp = self.session.get(url, params=params, timeout=10)
+                    self._last_status_code = resp.status_code
+                    self._last_headers = resp.headers
 
                 if resp.status_code == 429:
                     self.logger.warning("429 rate limit hit; backing off...")
-                    self.collection_stats["failed_requests"] += 1
-                    time.sleep(backoff * attempt)
+                    with self._lock:
+                        self._failed += 1
+                        self.decrease_rate()
+                    # Obey the server's Retry-After when given; blind backoff otherwise.
+                    # No point waiting after the last attempt, since nothing follows it.
+                    if attempt < tries:
+                        wait = self.parse_retry_after(resp.headers.get("Retry-After"))
+                        time.sleep(wait if wait is not None else self.retry_backoff(backoff, attempt))
                     continue
 
+                if resp.status_code >= 500:
+                    with self._lock:
+                        self.decrease_rate()
+                    # A 503 may also say when to come back; prefer that to blind backoff
+                    wait = self.parse_retry_after(resp.headers.get("Retry-After")) if attempt < tries else None
+                    if wait is not None:
+                        self.logger.warning(f"{resp.status_code} from server; retrying after {wait:.2f}s")
+                        with self._lock:
+                            self._failed += 1
+                        time.sleep(wait)
+                        continue
                 resp.raise_for_status()
-                self.collection_stats["successful_requests"] += 1
+                with self._lock:
+                    self._successful += 1
 
-                data = resp.json()
-                # capture next_url if present
-                self._cursor_next_url = data.get("next_url")
-                self.collection_stats["pages_fetched"] += 1
+                data = _loads(resp.content)
+                self.cache_response(cache_key, resp)
+                with self._lock:
+                    self._pages += 1
                 return data
 
-            except requests.exceptions.RequestException as e:
-                self.collection_stats["failed_requests"] += 1
+            except (requests.exceptions.RequestException, ValueError) as e:
+                # ValueError: malformed JSON body from the parser
+                with self._lock:
+                    self._failed += 1
                 self.logger.error(f"Request attempt {attempt}/{tries} failed: {e}")
                 if attempt < tries:
-                    time.sleep(backoff * attempt)
+                    time.sleep(self.retry_backoff(backoff, attempt))
 
         return None
 
+    # ---- HTTP cache (ETag / Last-Modified), persisted between runs ----
+    def _cache_path(self, name: str) -> str:
+        return os.path.join(self.config["cache_dir"], name)
+
+    def load_http_cache(self) -> Dict[str, Dict[str, str]]:
+        """Load saved validators per URL (best-effort; empty if missing/disabled)."""
+        if not self.config["cache_dir"]:
+            return {}
+        try:
+            with open(self._cache_path("etags.json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def conditional_headers(self, cache_key: str) -> Optional[Dict[str, str]]:
+        """If-None-Match / If-Modified-Since headers for a previously cached URL."""
+        entry = self._etag_store.get(cache_key)
+        if not entry:
+            return None
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers or None
+
+    def cached_page(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Parsed body saved for cache_key on an earlier 200; None if missing or unreadable."""
+        name = hashlib.sha1(cache_key.encode("utf-8")).hexdigest() + ".json"
+        try:
+            with open(self._cache_path(name), "rb") as f:
+                return _loads(f.read())
+        except OSError:
+            return None
+        except ValueError as e:
+            self.logger.warning(f"Discarding corrupt cached page {name}: {e}")
+            return None
+
+    def cache_response(self, cache_key: str, resp):
+        """Remember body + validators of a 200 response that carries ETag/Last-Modified."""
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if not self.config["cache_dir"] or not (etag or last_modified):
+            return
+        name = hashlib.sha1(cache_key.encode("utf-8")).hexdigest() + ".json"
+        try:
+            os.makedirs(self.config["cache_dir"], exist_ok=True)
+            with open(self._cache_path(name), "wb") as f:
+                f.write(resp.content)
+        except OSError as e:
+            self.logger.warning(f"Could not cache response body: {e}")
+            return
+        with self._lock:
+            self._etag_store[cache_key] = {"etag": etag, "last_modified": last_modified}
+
+    def save_http_cache(self):
+        """Persist validators so the next run can send conditional requests."""
+        if not self.config["cache_dir"] or not self._etag_store:
+            return
+        os.makedirs(self.config["cache_dir"], exist_ok=True)
+        _write_json(self._cache_path("etags.json"), self._etag_store)
+
     def process_data(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Extract results and trim to fields_to_keep; de-dup inside store_data."""
         results = data.get("results", [])
-        keep = self.config["fields_to_keep"]
+        keep = self._keep_fields
         if not results:
             return []
 
-        processed = []
-        for rec in results:
-            if keep:
-                processed.append({k: rec.get(k) for k in keep})
-            else:
-                processed.append(rec)
-        return processed
+        if not keep:
+            return list(results)
+
+        project = self._project
+        return [project(rec) for rec in results]
 
     def validate_data(self, batch: List[Dict[str, Any]]) -> bool:
         """Basic validation: require all 'required_fields' present and not empty."""
-        required = self.config["required_fields"]
-        valid = 0
-        for rec in batch:
-            if all(rec.get(f) not in (None, "") for f in required):
-                valid += 1
+        valid = sum(self.is_complete(rec) for rec in batch)
         # simple signal: at least 60% of batch valid
         return (valid / max(1, len(batch))) >= 0.6
 
     def store_data(self, batch: List[Dict[str, Any]]):
-        """Append unique records only (hash by dedupe_key_fields)."""
-        key_fields = self.config["dedupe_key_fields"]
-        added = 0
+        """Append unique records only (keyed by a tuple of dedupe_key_fields)."""
+        key_fields = self._dedupe_fields
+        new_recs = []
         for rec in batch:
-            key = "|".join(str(rec.get(k, "")) for k in key_fields)
-            h = hashlib.sha256(key.encode("utf-8")).hexdigest()
-            if h in self._seen_hashes:
+            # The set hashes the tuple itself; no need for a cryptographic digest.
+            key = tuple(rec.get(k) for k in key_fields)
+            try:
+                seen = key in self._seen_keys
+            except TypeError:
+                # unhashable value from the API (e.g. a list): key on its string form
+                key = tuple(str(v) if isinstance(v, (list, dict, set)) else v for v in key)
+                seen = key in self._seen_keys
+            if seen:
                 continue
-            self._seen_hashes.add(h)
-            self.data_store.append(rec)
-            added += 1
-        self.logger.info(f"Stored {added} new records (total: {len(self.data_store)})")
+            self._seen_keys.add(key)
+            new_recs.append(rec)
+            complete, accurate, consistent = self.quality_flags(rec)
+            self._ok_complete += complete
+            self._ok_accuracy += accurate
+            self._ok_consistency += consistent
+            self.count_for_report(rec)
+        # one growth of data_store per page rather than one append per record
+        self.data_store.extend(new_recs)
+        self.logger.info(f"Stored {len(new_recs)} new records (total: {len(self.data_store)})")
+
+    def count_for_report(self, rec: Dict[str, Any]):
+        """Update the completeness/anomaly counters read by the quality report."""
+        self._fields_seen.update(rec)
+        self._field_present.update(k for k, v in rec.items() if v not in (None, ""))
+        ticker = rec.get("ticker")
+        if ticker is not None and not isinstance(ticker, str):
+            # same normalisation as quality_flags; also keeps list values countable
+            ticker = str(ticker)
+        self._ticker_counts[ticker] += 1
+        # each distinct ticker is checked once, on first sight
+        if self._ticker_counts[ticker] == 1 and ticker and not _TICKER_RE.fullmatch(ticker):
+            self._invalid_tickers.append(ticker)
 
     # -------------------------
     # (3) DATA QUALITY
@@ -218,6 +602,10 @@ class DataCollectionAgent:
         """Evaluate the quality of collected data"""
         if not self.data_store:
             return 0.0
+        if len(self.data_store) == self._qa_assessed_len:
+            # nothing stored since the last poll (e.g. a failed page): reuse the score
+            return self.collection_stats["data_quality_score"]
+        self._qa_assessed_len = len(self.data_store)
 
         metrics = {
             'completeness': self.check_completeness(),
@@ -230,40 +618,36 @@ class DataCollectionAgent:
         self.logger.info(f"Quality metrics: {metrics} -> score={score:.2f}")
         return score
 
+    # Ratios come from counters kept by store_data, so each check is O(1)
+    # instead of re-scanning the whole data_store on every loop iteration.
     def check_completeness(self) -> float:
         """% of records where all required fields are present and non-empty."""
-        req = self.config["required_fields"]
-        ok = 0
-        for rec in self.data_store:
-            if all(rec.get(f) not in (None, "") for f in req):
-                ok += 1
-        return ok / max(1, len(self.data_store))
+        return self._ok_complete / max(1, len(self.data_store))
 
     def check_accuracy(self) -> float:
-        """
-        Placeholder accuracy check:
-          - For Polygon tickers, ensure ticker looks like A-Z/.- chars and name not empty.
-        """
-        ok = 0
-        for rec in self.data_store:
-            ticker = str(rec.get("ticker", ""))
-            name = str(rec.get("name", ""))
-            if ticker and name and all(ch.isalnum() or ch in ".-" for ch in ticker):
-                ok += 1
-        return ok / max(1, len(self.data_store))
+        """% of records passing the placeholder accuracy check (quality_flags)."""
+        return self._ok_accuracy / max(1, len(self.data_store))
 
     def check_consistency(self) -> float:
+        """% of records passing the string-type consistency check (quality_flags)."""
+        return self._ok_consistency / max(1, len(self.data_store))
+
+    def is_complete(self, rec: Dict[str, Any]) -> bool:
+        """All required fields present and non-empty."""
+        return all(rec.get(f) not in (None, "") for f in self._required_fields)
+
+    def quality_flags(self, rec: Dict[str, Any]):
         """
-        Simple consistency check:
-          - Fields that should be strings are strings.
+        (complete, accurate, consistent) for one record, in one pass over its fields.
+          - Accuracy (placeholder): ticker looks like A-Z/.- chars and name not empty.
+          - Consistency: fields that should be strings are strings.
         """
-        ok = 0
-        total = len(self.data_store)
-        for rec in self.data_store:
-            types_ok = isinstance(rec.get("ticker", ""), str) and isinstance(rec.get("name", ""), str)
-            if types_ok:
-                ok += 1
-        return ok / max(1, total)
+        ticker = rec.get("ticker", "")
+        name = rec.get("name", "")
+        ticker_s, name_s = str(ticker), str(name)
+        accurate = bool(ticker_s and name_s and _TICKER_RE.fullmatch(ticker_s))
+        consistent = isinstance(ticker, str) and isinstance(name, str)
+        return self.is_complete(rec), accurate, consistent
 
     def check_timeliness(self) -> float:
         """
@@ -277,102 +661,222 @@ class DataCollectionAgent:
     # (4) ADAPTIVE STRATEGY
     # -------------------------
     def adjust_strategy(self):
-        """Modify collection approach based on performance"""
+        """
+        Modify collection approach based on performance.
+          - Rate regrows as W(t) = C*(t - K)^3 + W_max, K = cbrt(W_max*(1-beta)/C), where
+            t is the time since the last decrease (see decrease_rate). Rate and time are
+            measured in budget intervals (1 / max_rate), so recovery takes a few requests
+            rather than the fraction of a second raw requests/second would give.
+          - Capped at the configured budget; falls back to gentler pages if most calls fail.
+          - Logs only when something actually changed (rate or fallback).
+        """
         sr = self.get_success_rate()
-        if sr < 0.5:
-            self.delay_multiplier = min(8.0, self.delay_multiplier * 2.0)
-            self.try_fallback_api()
-        elif sr < 0.8:
-            self.delay_multiplier = min(4.0, self.delay_multiplier * 1.5)
-        elif sr > 0.9:
-            self.delay_multiplier = max(0.5, self.delay_multiplier * 0.8)
-
-        self.log_strategy_change(sr)
+        prev_rate = self.rate
+        fell_back = False
+        if self._total_requests and sr < 0.5:
+            fell_back = self.try_fallback_api()
+
+        if self.last_decrease_t is not None:
+            interval = 1.0 / self.max_rate
+            t = (time.monotonic() - self.last_decrease_t) / interval
+            w_max = self.rate_max * interval
+            k = (w_max * (1 - self.CUBIC_BETA) / self.CUBIC_C) ** (1 / 3)
+            target = (w_max + self.CUBIC_C * (t - k) ** 3) / interval
+            self.rate = min(self.max_rate, max(self.min_rate, target))
+
+        if fell_back or self.rate != prev_rate:
+            self.log_strategy_change(sr)
+
+    def decrease_rate(self):
+        """Multiplicative decrease on throttling (429/5xx or nearly exhausted quota)."""
+        self.refill_bucket()
+        # Drop any burst credit: the server just said we are already too fast
+        self._tokens = min(self._tokens, 0.0)
+        self.rate_max = self.rate
+        self.rate = max(self.min_rate, self.rate * self.CUBIC_BETA)
+        self.last_decrease_t = time.monotonic()
 
     def get_success_rate(self) -> float:
-        total = self.collection_stats["total_requests"]
-        success = self.collection_stats["successful_requests"]
+        total = self._total_requests
+        success = self._successful
         return (success / total) if total else 0.0
 
-    def try_fallback_api(self):
+    def try_fallback_api(self) -> bool:
         """
         Example fallback: if current endpoint struggles, switch to a lighter one.
         (You can customize this to another Polygon endpoint you prefer.)
+        Returns True if the strategy was changed.
         """
         if self.config["endpoint"] != "/v3/reference/tickers":
-            return
+            return False
         self.logger.warning("Switching to fallback endpoint (still Polygon) due to low success rate.")
         self.config["endpoint"] = "/v3/reference/tickers"
         # reduce page size to be gentler
         self.config["params"]["limit"] = max(25, int(self.config["params"].get("limit", 100)) // 2)
+        return True
 
     def log_strategy_change(self, success_rate: float):
         self.logger.info(
-            f"Strategy adjusted: delay_multiplier={self.delay_multiplier:.2f}, "
+            f"Strategy adjusted: rate={self.rate * 60:.2f}/min, "
+            f"congestion_rate={self.rate_max * 60:.2f}/min, bucket={self._tokens:.2f}, "
             f"success_rate={success_rate:.2f}, last_status={self._last_status_code}"
         )
 
     # -------------------------
     # (5) RESPECTFUL COLLECTION
     # -------------------------
-    def respectful_delay(self):
-        """Implement respectful rate limiting with jitter and RPM budget."""
-        # Honor an RPM budget (soft)
+    def min_request_interval(self) -> float:
+        """Seconds per request implied by the RPM budget (soft) and base_delay."""
         rpm = float(self.config.get("respect_rpm", 4))
         min_delay_from_rpm = max(60.0 / max(rpm, 0.1), 0.5)  # seconds/request
         base_delay = float(self.config.get('base_delay', 1.0))
-        delay = max(base_delay, min_delay_from_rpm) * self.delay_multiplier
+        return max(base_delay, min_delay_from_rpm)
 
-        # Add jitter to avoid thundering herd
-        jitter = random.uniform(0.8, 1.3)
-        final_sleep = delay * jitter
+    def respectful_delay(self, n_requests: int = 1):
+        """Implement respectful rate limiting with jitter at the adaptive rate."""
+        self.schedule_next_request(n_requests)
+        self.wait_for_next_request()
 
+    def schedule_next_request(self, n_requests: int = 1):
+        """Set the deadline before which the next request must not be sent."""
         # If headers expose remaining limits, slow down preemptively
         self.check_rate_limits()
 
-        self.logger.info(f"Sleeping {final_sleep:.2f}s (respectful delay)")
-        time.sleep(final_sleep)
+        # Token bucket: refill for the time elapsed, then spend one token per request
+        # just made (a concurrent batch spends n_requests at once)
+        self.refill_bucket()
+        self._tokens -= n_requests
+        # Only wait as long as it takes to accrue one whole token (0 while burst credit remains)
+        wait = max(0.0, (1.0 - self._tokens) / self.rate)
+
+        if self.rate < self.max_rate:
+            # Server is pushing back: no bursting, and decorrelated jitter (AWS) spreads
+            # clients apart instead of letting them retry in lock-step
+            cap = self.min_request_interval() * 8 * n_requests
+            base = max(wait, n_requests / self.rate)
+            final_sleep = min(cap, random.uniform(base, self._prev_sleep * 3.0))
+        elif wait > 0:
+            # Steady state: mild jitter around the refill time to avoid thundering herd
+            final_sleep = wait * random.uniform(0.8, 1.3)
+        else:
+            final_sleep = 0.0
+        self._prev_sleep = max(final_sleep, self.min_request_interval())
+
+        # Never call again before the server's rate-limit window reopens
+        if self._next_allowed_t is not None:
+            final_sleep = max(final_sleep, self._next_allowed_t - time.monotonic())
+            self._next_allowed_t = None
+
+        self._next_request_t = time.monotonic() + final_sleep
+
+    def refill_bucket(self):
+        """Credit tokens for the time since the last refill, at the current rate."""
+        now = time.monotonic()
+        self._tokens = min(self.burst_capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def wait_for_next_request(self):
+        """Sleep until the scheduled deadline (no-op if it has already passed)."""
+        remaining = self._next_request_t - time.monotonic()
+        if remaining > 0:
+            self.logger.info(f"Sleeping {remaining:.2f}s (respectful delay)")
+            time.sleep(remaining)
 
     def check_rate_limits(self):
         """Monitor and respect API rate limits if headers are provided (best-effort)."""
         # Many APIs include headers like: X-RateLimit-Remaining, X-RateLimit-Reset, etc.
         # Polygon may not always return standard ones for your plan; we handle best-effort.
-        remaining = None
-        for k, v in self._last_headers.items():
-            if k.lower().endswith("ratelimit-remaining"):
-                try:
-                    remaining = float(v)
-                except Exception:
-                    remaining = None
+        headers = self._last_headers
+        remaining = self._header_float(
+            headers.get("X-RateLimit-Remaining") or headers.get("RateLimit-Remaining"))
+        reset = self._header_float(
+            headers.get("X-RateLimit-Reset") or headers.get("RateLimit-Reset"))
 
         if remaining is not None and remaining < 2:
-            # If we’re nearly out of calls, bump multiplier
-            self.delay_multiplier = min(8.0, self.delay_multiplier * 1.5)
-            self.logger.warning("Near rate limit; increasing delay multiplier.")
+            if reset is not None:
+                # Reset is either an epoch timestamp or seconds until the window reopens
+                reset_in = reset - time.time() if reset > 1e9 else reset
+                self._next_allowed_t = time.monotonic() + max(0.0, reset_in)
+                self.logger.warning(f"Near rate limit; waiting {max(0.0, reset_in):.2f}s for window reset.")
+            else:
+                # If we’re nearly out of calls, back off the request rate
+                self.decrease_rate()
+                self.logger.warning("Near rate limit; decreasing request rate.")
+
+    @staticmethod
+    def _header_float(value: Optional[str]) -> Optional[float]:
+        """Parse a numeric header value; None if absent or malformed."""
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    @staticmethod
+    def retry_backoff(base: float, attempt: int, cap: float = 60.0) -> float:
+        """
+        Exponential backoff with full jitter: uniform in [0, min(cap, base * 2^(attempt-1))].
+          - Spreads out retries from workers that were throttled together.
+          - A server-supplied Retry-After still takes precedence (see fetch_one).
+        """
+        return random.uniform(0.0, min(cap, base * 2 ** (attempt - 1)))
+
+    def parse_retry_after(self, value: Optional[str]) -> Optional[float]:
+        """
+        Seconds to wait from a Retry-After header (delta-seconds or HTTP-date).
+          - Capped at retry.max_retry_after_seconds so a huge value can't stall the run.
+        """
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            wait = float(value)
+        else:
+            try:
+                when = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            if when.tzinfo is None:
+                when = when.replace(tzinfo=timezone.utc)
+            wait = max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+        cap = float(self.config["retry"]["max_retry_after_seconds"])
+        if wait > cap:
+            self.logger.warning(f"Retry-After of {wait:.0f}s exceeds cap; waiting {cap:.0f}s instead")
+            return cap
+        return wait
 
     # -------------------------
     # SAVE & REPORT
     # -------------------------
     def save_outputs(self):
         """Persist results and stats to disk."""
-        out_json = self.config["output"]["json_path"]
-        with open(out_json, "w") as f:
-            json.dump(self.data_store, f, indent=2)
-        self.logger.info(f"Saved JSON: {out_json}")
+        fmt = self.config["output_format"]
+        out_path = self.config["output"][f"{fmt}_path"]
+        # Records are streamed one by one so the whole store is never encoded in memory at once
+        _write_records(out_path, self.data_store, fmt)
+        self.logger.info(f"Saved output ({fmt}): {out_path}")
 
         # Also save a concise summary for your submission
         summary_path = "agent_summary.json"
-        with open(summary_path, "w") as f:
-            json.dump(self.summary(), f, indent=2)
+        _write_json(summary_path, self.summary())
         self.logger.info(f"Saved summary: {summary_path}")
 
+        self.save_http_cache()
+
     def summary(self) -> Dict[str, Any]:
+        stats = self.collection_stats
         return {
-            **self.collection_stats,
+            "start_time": stats["start_time"],
+            "total_requests": self._total_requests,
+            "successful_requests": self._successful,
+            "failed_requests": self._failed,
+            "data_quality_score": stats["data_quality_score"],
+            "last_quality_score": stats["last_quality_score"],
+            "pages_fetched": self._pages,
+            "apis_used": stats["apis_used"],
             "records_collected": len(self.data_store),
             "endpoint": self.config["endpoint"],
             "kept_fields": self.config["fields_to_keep"],
-            "delay_multiplier": self.delay_multiplier
+            "request_rate_per_min": self.rate * 60
         }
     # --------- PART 5: Documentation & QA ---------
 
@@ -390,8 +894,7 @@ class DataCollectionAgent:
             "processing_history": self.get_processing_log(max_lines=200),
             "variables": self.generate_data_dictionary()
         }
-        with open("dataset_metadata.json", "w") as f:
-            json.dump(metadata, f, indent=2)
+        _write_json("dataset_metadata.json", metadata)
         self.logger.info("Saved dataset_metadata.json")
 
     def get_sources_used(self):
@@ -417,9 +920,20 @@ class DataCollectionAgent:
     def get_processing_log(self, max_lines=200):
         """Return tail of the log file for lineage / processing history."""
         log_path = self.config.get("output", {}).get("log_path", "data_collection.log")
+        self.flush_logs()
         try:
-            with open(log_path, "r") as f:
-                lines = f.readlines()[-max_lines:]
+            # Read backwards from the end in blocks until max_lines are covered,
+            # so a long-running log is never loaded whole.
+            with open(log_path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                pos = f.tell()
+                tail = b""
+                while pos > 0 and tail.count(b"\n") <= max_lines:
+                    step = min(pos, max_lines * 256)
+                    pos -= step
+                    f.seek(pos)
+                    tail = f.read(step) + tail
+            lines = tail.decode("utf-8", "replace").splitlines()[-max_lines:]
             return [ln.strip() for ln in lines]
         except Exception:
             return ["No log available"]
@@ -462,8 +976,7 @@ class DataCollectionAgent:
             "recommendations": self.generate_recommendations()
         }
 
-        with open("quality_report.json", "w") as f:
-            json.dump(report, f, indent=2)
+        _write_json("quality_report.json", report)
         self.logger.info("Saved quality_report.json")
 
         # Also produce a human-readable version
@@ -473,18 +986,12 @@ class DataCollectionAgent:
         """Percent present for each kept field."""
         if not self.data_store:
             return {}
-        fields = sorted({k for rec in self.data_store for k in rec.keys()})
-        totals = {k: 0 for k in fields}
+        # Counts were kept as records were stored (count_for_report)
         n = len(self.data_store)
-        for rec in self.data_store:
-            for k in fields:
-                if rec.get(k) not in (None, ""):
-                    totals[k] += 1
-        return {k: totals[k] / n for k in fields}
+        return {k: self._field_present[k] / n for k in sorted(self._fields_seen)}
 
     def analyze_distribution(self):
         """Simple distributions for categorical fields commonly present."""
-        from collections import Counter
         dist = {}
         for key in ["market", "locale", "primary_exchange"]:
             vals = [rec.get(key) for rec in self.data_store if key in rec]
@@ -493,23 +1000,12 @@ class DataCollectionAgent:
 
     def detect_anomalies(self):
         """Basic anomaly checks: duplicates and invalid tickers."""
-        anomalies = {
-            "duplicate_tickers": [],
-            "invalid_ticker_chars": []
+        # Running counts from count_for_report; invalid = fails alnum/dot/hyphen rule
+        dupes = [t for t, c in self._ticker_counts.items() if c > 1 and t]
+        return {
+            "duplicate_tickers": sorted(dupes)[:50],
+            "invalid_ticker_chars": list(self._invalid_tickers)
         }
-        seen = set()
-        dupes = set()
-        for rec in self.data_store:
-            t = rec.get("ticker")
-            if t in seen:
-                dupes.add(t)
-            else:
-                seen.add(t)
-            # simple char rule: alnum, dot, hyphen
-            if t and not all(ch.isalnum() or ch in ".-" for ch in t):
-                anomalies["invalid_ticker_chars"].append(t)
-        anomalies["duplicate_tickers"] = sorted(list(dupes))[:50]
-        return anomalies
 
     def generate_recommendations(self):
         """Text recommendations based on quality & rate limiting behavior."""
@@ -517,7 +1013,7 @@ class DataCollectionAgent:
         quality = self.collection_stats.get("data_quality_score", 0.0)
         recs = []
         if sr < 0.8:
-            recs.append("Increase delay multiplier and/or reduce per-page limit to improve success rate.")
+            recs.append("Lower respect_rpm and/or reduce per-page limit to improve success rate.")
         else:
             recs.append("Success rate is healthy; consider modestly increasing request rate.")
 
@@ -575,7 +1071,7 @@ class DataCollectionAgent:
         lines.append(f"- Endpoint: {s.get('endpoint')}")
         lines.append(f"- Kept fields: {', '.join(s.get('kept_fields') or [])}")
         lines.append(f"- Overall quality score: {self.get_overall_quality_score():.2f}")
-        lines.append(f"- Delay multiplier (final): {s.get('delay_multiplier'):.2f}\n")
+        lines.append(f"- Request rate (final): {s.get('request_rate_per_min'):.2f}/min\n")
 
         lines.append("## Issues Encountered")
         # very simple heuristics based on last status codes / failures
@@ -604,5 +1100,6 @@ if __name__ == "__main__":
     agent.generate_metadata()
     agent.generate_quality_report()
     agent.generate_collection_summary()
+    agent.close()
     print("\n=== AGENT SUMMARY ===")
     print(json.dumps(agent.summary(), indent=2))
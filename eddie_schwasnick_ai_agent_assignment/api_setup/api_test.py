@@ -24,12 +24,13 @@ def get_polygon_tickers(limit=5):
     url = "https://api.polygon.io/v3/reference/tickers"
     params = {
         "active": "true",
-        "limit": limit,
-        "apiKey": api_key
+        "limit": limit
     }
+    # Same auth as the agent: key in a bearer header, not in the query string
+    headers = {"Authorization": f"Bearer {api_key}"}
 
     try:
-        resp = requests.get(url, params=params, timeout=10)
+        resp = requests.get(url, params=params, headers=headers, timeout=10)
         resp.raise_for_status()
         return resp.json()
     except requests.exceptions.RequestException as e:
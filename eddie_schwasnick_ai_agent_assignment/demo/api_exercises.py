@@ -1,47 +1,71 @@
+import sys
 import requests
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # optional: faster JSON parsing and writes
+except ImportError:
+    orjson = None
 
 ## API Demo: Fetching Cat Facts
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO)
 
+# One pooled session for the whole script: repeat calls to the same host reuse
+# the open connection (no new TCP/TLS handshake), and brief 502/503/504s are retried
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504])))
+
+# Write JSON with orjson when installed (2-space indent), stdlib json otherwise
+def write_json(path, obj):
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, "w") as f:
+            json.dump(obj, f, indent=2)
+
+# Parse a response body with orjson when installed (straight from bytes), else requests' .json()
+def parse_json(response):
+    return orjson.loads(response.content) if orjson is not None else response.json()
+
 # Make your first API call to get a random cat fact
 def get_five_cat_facts():
     url = "https://catfact.ninja/fact"
     facts = []
-    
-    for i in range(5):
-        try:
-            
-            # Send GET request to the API
-            fact = requests.get(url)
-            
-            # Check if request was successful
-            if fact.status_code == 200:
-                # Parse JSON response
-                data = fact.json()
-                facts.append(data['fact'])
-                logging.info(f"Retrieved fact {i+1}")
 
-            else:
-               logging.error(f"Error: {fact.status_code}")
+    # The five requests are independent, so send them all at once over the
+    # shared session (threads just wait on the network) instead of one by one
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(SESSION.get, url, timeout=5) for _ in range(5)]
 
-        except Exception as e:
-            logging.exception("An error occurred while fetching a cat fact")
+        for i, future in enumerate(as_completed(futures)):
+            try:
 
-    return facts
+                # Wait for this GET request to finish
+                fact = future.result()
+                fact.raise_for_status()  # Raises an exception for bad status codes
+
+                # Parse JSON response
+                data = parse_json(fact)
+                facts.append(data['fact'])
+                logging.info("Retrieved fact %d", i + 1)
 
-# Get five cat facts
-cat_facts = get_five_cat_facts()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logging.error("Fact %d request failed: %s", i + 1, e)
 
-# Print the cat facts
-for i, fact in enumerate(cat_facts, 1):
-    print(f"Fact {i}: {fact}")
+            except (KeyError, TypeError) as e:
+                # 200 response without the expected {"fact": ...} shape
+                logging.error("Fact %d had an unexpected payload: %r", i + 1, e)
 
-# Save to JSON file
-with open("cat_facts.json", "w") as f:
-    json.dump(cat_facts, f, indent=4)
+    return facts
 
 
 
@@ -51,47 +75,87 @@ with open("cat_facts.json", "w") as f:
 # Using Nager.Date API (free, no key required)
 import requests
 
+# Endpoint template, filled per (country, year) lookup
+HOLIDAYS_URL = "https://date.nager.at/api/v3/PublicHolidays/{year}/{country_code}".format
+# Cap on simultaneous holiday requests, however many (country, year) pairs there are
+MAX_HOLIDAY_WORKERS = 10
+
+@lru_cache(maxsize=32)
+def fetch_public_holidays(country_code, year):
+    """
+    Memoized raw lookup per (country_code, year), so repeat calls in the same
+    session (e.g. a notebook) skip the network. Errors raise and are not cached.
+    """
+    url = HOLIDAYS_URL(year=year, country_code=country_code)
+    response = SESSION.get(url, timeout=10)
+    response.raise_for_status()  # Raises an exception for bad status codes
+    return parse_json(response)
+
 def get_public_holidays(country_code="US", year=2024):
     """
     Get public holidays for a specific country and year
     Uses Nager.Date API (free, no key required)
     """
-    url = f"https://date.nager.at/api/v3/PublicHolidays/{year}/{country_code}"
-    
     try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raises an exception for bad status codes
-        
-        holidays = response.json()
+        holidays = fetch_public_holidays(country_code, year)
         return holidays
     
-    except requests.exceptions.RequestException as e:
-        logging.error(f"[{country_code}] Request failed: {e}")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.error("[%s %s] Request failed: %s", country_code, year, e)
         return None
 
-# Test with different countries
+# Test with different countries and years
 countries = ['US', 'CA', 'GB']
-all_data = {}
-for country in countries:
-    holidays = get_public_holidays(country)
-    if holidays:
-        # Extract only date + name
-        extracted = [{"date": h["date"], "name": h["name"]} for h in holidays]
-        all_data[country] = extracted
-
-        # Print the holidays
-        print(f"\n{country} holidays in 2024:")
-        for h in extracted:
-            print(f"{h['date']} — {h['name']}")
-    else:
-        all_data[country] = []
-        print(f"\n{country} holidays in 2024: No data.")
-
-# Save extracted holidays to JSON
-with open("holidays.json", "w") as f:
-    json.dump(all_data, f, indent=4)
-
-# Summary of holiday counts
-print("\n=== Summary of Holiday Counts ===")
-for country, holidays in all_data.items():
-    print(f"{country}: {len(holidays)} holidays")
+years = [2024]
+pairs = [(country, year) for country in countries for year in years]
+all_data = {country: {} for country in countries}
+
+
+## Run both demos as one pipeline
+# The cat facts and the holidays don't depend on each other, so every request
+# is submitted up front and both sets run at the same time over SESSION; the
+# results are then collected in order, so the printout reads as before.
+# Files are written on a background thread so nothing waits behind disk I/O;
+# the with-block makes sure queued writes finish even if a later step fails.
+with ThreadPoolExecutor(max_workers=1) as writer:
+    with ThreadPoolExecutor(max_workers=1 + min(len(pairs), MAX_HOLIDAY_WORKERS)) as executor:
+        cat_facts_future = executor.submit(get_five_cat_facts)
+        futures = {pair: executor.submit(get_public_holidays, *pair) for pair in pairs}
+
+        # Get five cat facts
+        cat_facts = cat_facts_future.result()
+
+        # Print the cat facts (one write for the whole block)
+        sys.stdout.write("".join(f"Fact {i}: {fact}\n" for i, fact in enumerate(cat_facts, 1)))
+
+        # Save to JSON file (in the background while the holiday requests are in flight)
+        cat_facts_saved = writer.submit(write_json, "cat_facts.json", cat_facts)
+
+    for (country, year), future in futures.items():
+        holidays = future.result()
+        if holidays:
+            # Extract only date + name, as parallel lists: {"date": [...], "name": [...]}
+            extracted = {"date": [h["date"] for h in holidays],
+                         "name": [h["name"] for h in holidays]}
+            all_data[country][str(year)] = extracted
+
+            # Print the holidays (one write per country/year block)
+            lines = [f"\n{country} holidays in {year}:"]
+            lines += [f"{date} — {name}" for date, name in zip(extracted["date"], extracted["name"])]
+            sys.stdout.write("\n".join(lines) + "\n")
+        else:
+            all_data[country][str(year)] = {"date": [], "name": []}
+            print(f"\n{country} holidays in {year}: No data.")
+
+    # Save extracted holidays to JSON (in the background while the summary prints)
+    holidays_saved = writer.submit(write_json, "holidays.json", all_data)
+
+    # Summary of holiday counts
+    print("\n=== Summary of Holiday Counts ===")
+    for country, by_year in all_data.items():
+        for year, holidays in by_year.items():
+            print(f"{country} {year}: {len(holidays['date'])} holidays")
+
+    # Surface any write error (leaving the block also waits for queued writes)
+    cat_facts_saved.result()
+    holidays_saved.result()